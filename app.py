@@ -1,7 +1,10 @@
+import hashlib
+import os
+import time
+from contextlib import contextmanager
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime, timedelta, date
 from io import BytesIO
 
@@ -20,7 +23,7 @@ def add_ios_style():
     <style>
     .stApp { background-color: #F2F2F7; font-family: -apple-system, BlinkMacSystemFont, "SF Pro Text", sans-serif; }
     section[data-testid="stSidebar"] { background-color: #FFFFFF; border-right: 1px solid #E5E5EA; }
-    .ios-card {
+    .ios-card, div[class*="st-key-ios-card-"] {
         background: rgba(255,255,255,0.9);
         backdrop-filter: blur(20px);
         border-radius: 16px; padding:20px;
@@ -46,140 +49,400 @@ def add_ios_style():
 
 add_ios_style()
 
+@contextmanager
+def ios_card(name):
+    # 卡片用带 key 的原生容器承载，前端会加上 st-key-ios-card-<name> 类名供 add_ios_style 匹配；不再在前后各发一条 HTML 片段
+    with st.container(key=f"ios-card-{name}"):
+        yield
+
 # --------------------------
 # 状态初始化
 # --------------------------
 if 'data_loaded' not in st.session_state: st.session_state.data_loaded = False
-if 'df' not in st.session_state: st.session_state.df = None
 if 'processed_df' not in st.session_state: st.session_state.processed_df = None
 if 'time_column' not in st.session_state: st.session_state.time_column = None
+if 'file_hash' not in st.session_state: st.session_state.file_hash = None
+if 'excel_range' not in st.session_state: st.session_state.excel_range = None
 if 'selected_page' not in st.session_state: st.session_state.selected_page = "销量分析看板"
 
 WEEK_ORDER = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+CHUNK_SIZE = 500_000
+KEEP_COLS = ['SKU', 'ASIN', '产品名称', '数量', '订单号', '采购总额', '销售总额']
+CATEGORY_COLS = ['SKU', 'ASIN', '产品名称', '订单号']
+SALES_RANGES = ['今日', '昨日', '近7天', '近14天', '近30天', '自定义']
+ORDER_RANGES = ['近7天', '近14天', '近30天', '上个月', '全部', '自定义']
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M', 'ISO8601']
+TZ_SUFFIX = r'(?<=\d)(?:Z|[+-]\d{2}:?\d{2})$'  # 时间末尾的时差后缀，如 +08:00 / -0500 / Z
+EXPORT_HELP = "仅导出分析用到的列（时间、" + "、".join(KEEP_COLS) + " 及小时/星期/订单日期），上传文件中的其他列不包含在内"
+TOP_N_OPTIONS = [50, 100, 500, 2000]
+SIDECAR_DIR = os.environ.get('AMZTOOLS_CACHE_DIR')  # 副本含订单明细，默认不落盘；由部署方显式配置目录后才启用
+SIDECAR_VERSION = 1  # process_order_data 的输出列或类型变化时递增，旧副本自动失效
+SIDECAR_MAX_FILES = 8
+SIDECAR_TTL = 7 * 86400
+PCT_CONFIG = {c: st.column_config.NumberColumn(format="%.1f%%") for c in ('销量占比', '销售额占比')}
 
 # --------------------------
 # 工具函数
 # --------------------------
+@st.cache_resource
+def week_dtype():
+    return pd.CategoricalDtype(WEEK_ORDER, ordered=True)
+
 def validate_date(d):
     if isinstance(d, date): return d
     if isinstance(d, datetime): return d.date()
     return date.today()
 
+def quick_range(choice, min_date, max_date):
+    if choice == '今日': return max_date, max_date
+    if choice == '昨日': return max_date - timedelta(1), max_date - timedelta(1)
+    if choice == '近7天': return max_date - timedelta(6), max_date
+    if choice == '近14天': return max_date - timedelta(13), max_date
+    if choice == '近30天': return max_date - timedelta(29), max_date
+    if choice == '上个月':
+        first_this = pd.Timestamp(max_date).replace(day=1)
+        return (first_this - pd.offsets.MonthBegin(1)).date(), (first_this - pd.Timedelta(days=1)).date()
+    return min_date, max_date
+
+def detect_time_column(columns):
+    time_candidates = [c for c in columns if any(x in c for x in ['时间','日期','time','date'])]
+    return time_candidates[0] if time_candidates else columns[0]
+
+def analysis_columns(columns):
+    return list(dict.fromkeys([detect_time_column(columns)] + [c for c in KEEP_COLS if c in columns]))
+
+def detect_time_format(col):
+    # 用前 100 个样本探测固定格式，整列按 C 层 strptime 解析，比逐行推断快一个量级
+    sample = col.dropna().astype(str).iloc[:100]
+    for fmt in TIME_FORMATS:
+        if pd.to_datetime(sample, format=fmt, errors='coerce').notna().all(): return fmt
+    return None
+
+def parse_time(col):
+    if pd.api.types.is_datetime64_any_dtype(col): return col
+    # 带时差后缀时去掉后缀按本地钟点解析：小时/日期与下单地时间一致，混合时差（夏令时）也不会报错或被折算成 UTC
+    if col.dropna().astype(str).iloc[:100].str.contains(TZ_SUFFIX).any(): col = col.astype(str).str.replace(TZ_SUFFIX, '', regex=True)
+    return pd.to_datetime(col, format=detect_time_format(col), errors='coerce', cache=True)
+
+def as_categories(df):
+    # 重复度高的字符串列转为分类，分组按整数编码进行
+    for c in CATEGORY_COLS:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype): df[c] = df[c].astype('category')
+    return df
+
+def calendar_fields(times):
+    # 在无时区 datetime64 数组上直接做整数运算得到小时/星期/日期，不经 .dt 访问器逐字段分解
+    t = times.to_numpy()
+    day = t.astype('datetime64[D]')
+    hour = ((t - day) // np.timedelta64(1, 'h')).astype(np.int8)
+    dow = ((day.view('i8') + 3) % 7).astype(np.int8)  # 1970-01-01 为周四，周一编码为 0
+    return hour, dow, day.astype('datetime64[ns]')
+
 def process_order_data(df, time_col):
-    df[time_col] = pd.to_datetime(df[time_col], errors='coerce')
-    df = df.dropna(subset=[time_col])
-    df['小时'] = df[time_col].dt.hour
-    df['星期'] = df[time_col].dt.dayofweek.map({
-        0:'周一',1:'周二',2:'周三',3:'周四',4:'周五',5:'周六',6:'周日'
-    })
-    df['订单日期'] = df[time_col].dt.date
+    times = parse_time(df[time_col])
+    # 仅在存在无效时间时做一次布尔筛选，代替 dropna 的整表复制
+    valid = times.notna()
+    if not valid.all(): df, times = df.loc[valid], times[valid]
+    # 带时区的时间（如亚马逊 purchase-date 的 +00:00 / Z）保留原钟点去掉时区，日期筛选和分组统一按无时区时间比较
+    if isinstance(times.dtype, pd.DatetimeTZDtype): times = times.dt.tz_localize(None)
+    hour, dow, day = calendar_fields(times)
+    # 只保留分析用到的列，新建的表不再引用原始宽表
+    out = pd.DataFrame({
+        time_col: times,
+        '小时': hour,
+        '星期': pd.Categorical.from_codes(dow, dtype=week_dtype()),
+        '订单日期': day,
+    }, index=times.index)
+    for c in KEEP_COLS:
+        if c in df.columns and c != time_col: out[c] = df[c]
+    if '数量' in out.columns: out['数量'] = pd.to_numeric(out['数量'], errors='coerce', downcast='integer')
+    return as_categories(out).sort_values('订单日期', kind='stable', ignore_index=True)
+
+def date_slice(df, s_date, e_date):
+    # df 已按订单日期排序，二分查找边界后切片，免去整列布尔掩码
+    dates = df['订单日期']
+    lo = dates.searchsorted(pd.Timestamp(s_date), side='left')
+    hi = dates.searchsorted(pd.Timestamp(e_date), side='right')
+    if lo == 0 and hi == len(df): return df
+    return df.iloc[lo:hi]
+
+def read_table(file_bytes, name, str_cols=(), **kwargs):
+    # 优先用 pyarrow / calamine 解析，缺少依赖或旧版 pandas 时回退默认引擎
+    # CSV 的 str_cols 按字符串读入：pandas 的 pyarrow 引擎在转换后才应用 dtype，带时差的时间此时已被折算成 UTC，只能直接调用 pyarrow.csv
+    try:
+        if name.endswith('.csv') and str_cols:
+            import pyarrow as pa, pyarrow.csv as pacsv
+            # strings_can_be_null：空串按缺失值处理，与 pandas 读取一致（否则空订单号会被当成一个订单）
+            opts = pacsv.ConvertOptions(include_columns=kwargs.get('usecols'), column_types={c: pa.string() for c in str_cols}, strings_can_be_null=True)
+            return pacsv.read_csv(BytesIO(file_bytes), convert_options=opts).to_pandas()
+        if name.endswith('.csv'): return pd.read_csv(BytesIO(file_bytes), engine='pyarrow', **kwargs)
+        return pd.read_excel(BytesIO(file_bytes), engine='calamine', **kwargs)
+    except (ImportError, ValueError):
+        buf = BytesIO(file_bytes)
+        if name.endswith('.csv'): return pd.read_csv(buf, dtype={c: str for c in str_cols}, **kwargs)
+        return pd.read_excel(buf, **kwargs)
+
+@st.cache_data(show_spinner=False)
+def read_head(file_bytes, name, n=5):
+    # 只读前几行，用于表头识别和预览
+    if name.endswith('.csv'): return pd.read_csv(BytesIO(file_bytes), nrows=n)
+    return read_table(file_bytes, name, nrows=n)
+
+def csv_str_cols(columns):
+    # 两种导入方式共用：时间列按字符串读入，统一由 parse_time 按本地钟点解析；分类列按字符串读入，保留前导零且各块类型一致
+    return [detect_time_column(columns)] + [c for c in CATEGORY_COLS if c in columns]
+
+def load_df(file_bytes, name):
+    # 先读表头，只解析时间列和分析用到的列，宽表的其余列不进入内存；不单独缓存，处理完即释放
+    columns = read_head(file_bytes, name).columns
+    return read_table(file_bytes, name, str_cols=csv_str_cols(columns), usecols=analysis_columns(columns))
+
+def load_csv_chunked(file_bytes, name, time_col, progress):
+    # 大文件模式：分块解析并逐块处理，原始字符串列不会整表驻留；列与类型设置与 load_df 相同，结果一致
+    # 处理后的各块在合并时会与合并结果短暂并存，内存峰值约为处理后数据的两倍
+    columns = read_head(file_bytes, name).columns
+    buf = BytesIO(file_bytes)
+    parts = []
+    with pd.read_csv(buf, chunksize=CHUNK_SIZE, usecols=analysis_columns(columns), dtype={c: str for c in csv_str_cols(columns)}) as reader:
+        for chunk in reader:
+            parts.append(process_order_data(chunk, time_col))
+            progress.progress(min(buf.tell() / len(file_bytes), 1.0))
+    # 各块的分类取值不同，合并后会退化为 object，需重新转换
+    return as_categories(pd.concat(parts, ignore_index=True)).sort_values('订单日期', kind='stable', ignore_index=True)
+
+def sidecar_path(file_hash):
+    return os.path.join(SIDECAR_DIR, f"{file_hash}_v{SIDECAR_VERSION}.parquet")
+
+def read_sidecar(file_hash):
+    # 同一文件处理过一次后直接读 parquet 副本，跳过解析和时间转换；未启用、副本缺失、损坏或列不符时返回 None
+    if not SIDECAR_DIR: return None
+    path = sidecar_path(file_hash)
+    if not os.path.exists(path): return None
+    try:
+        df = pd.read_parquet(path)
+        # parquet 可能丢弃未出现的星期类别，恢复完整的有序类别，保证编码与 week_hour_matrix 一致
+        df['星期'] = df['星期'].astype(week_dtype())
+        os.utime(path)  # 读取即刷新修改时间，清理时按最近使用保留
+    except (ImportError, ValueError, OSError, KeyError):
+        return None
+    return df
+
+def prune_sidecars(keep=SIDECAR_MAX_FILES, ttl=SIDECAR_TTL):
+    # 删除过期副本，并按修改时间（读写时都会刷新）只保留最近使用的若干个，限制磁盘占用
+    try:
+        entries = sorted((e for e in os.scandir(SIDECAR_DIR) if e.is_file()), key=lambda e: e.stat().st_mtime, reverse=True)
+        for i, e in enumerate(entries):
+            if i >= keep or time.time() - e.stat().st_mtime > ttl: os.remove(e.path)
+    except OSError:
+        pass
+
+def write_sidecar(df, file_hash):
+    # 副本含订单明细，只写入仅当前用户可读的私有目录；先写临时文件再替换，避免中断时留下半个副本；缺少 pyarrow 或磁盘不可写时静默跳过
+    if not SIDECAR_DIR: return
+    path = sidecar_path(file_hash)
+    try:
+        os.makedirs(SIDECAR_DIR, mode=0o700, exist_ok=True)
+        df.to_parquet(path + '.tmp', index=False)
+        os.chmod(path + '.tmp', 0o600)
+        os.replace(path + '.tmp', path)
+    except (ImportError, ValueError, OSError):
+        pass
+    prune_sidecars()
+
+def remove_sidecar(file_hash):
+    if not SIDECAR_DIR: return
+    try: os.remove(sidecar_path(file_hash))
+    except OSError: pass
+
+@st.cache_resource(show_spinner=False, max_entries=4, ttl=3600)
+def build_processed(file_hash, name, time_col, _file_bytes, _progress=None):
+    # 按资源缓存：命中时直接返回同一对象，不做反序列化拷贝；返回的表只读，下游一律切片/聚合，不得原地修改
+    # 以调用方已算好的 file_hash 为键，文件内容以 _ 前缀传入不再重复哈希
+    # 进程内未命中时先查磁盘副本，仍未命中才解析；传入 _progress 时按大文件模式分块处理
+    df = read_sidecar(file_hash)
+    if df is None:
+        if _progress is not None: df = load_csv_chunked(_file_bytes, name, time_col, _progress)
+        else: df = process_order_data(load_df(_file_bytes, name), time_col)
+        write_sidecar(df, file_hash)
     return df
 
-def to_excel(df):
+def week_hour_matrix(df):
+    # 星期编码*24+小时 → 7×24 计数矩阵，一次 bincount 同时得到星期、小时分布
+    idx = df['星期'].cat.codes.to_numpy().astype(np.int64) * 24 + df['小时'].to_numpy()
+    return np.bincount(idx, minlength=7*24).reshape(7, 24)
+
+def unique_orders(df, keys, index):
+    # 先去重再计数，代替逐组建集合的 nunique；空订单号不计入，与 nunique 一致
+    uniq = df[keys + ['订单号']].dropna(subset=['订单号']).drop_duplicates()
+    return uniq.groupby(keys, sort=False, observed=True).size().reindex(index, fill_value=0)
+
+# 以下缓存按 data_key（上传文件的 md5）区分数据，整表以 _ 前缀参数传入不参与哈希：
+# Streamlit 对 5 万行以上的表只哈希抽样行，同行数的修正文件会命中旧结果
+@st.cache_data(show_spinner=False)
+def daily_agg(_df, data_key):
+    # 数据已按订单日期排序，分组结果天然有序，无需再排序
+    out = _df.groupby('订单日期', sort=False).agg(
+        数量=('数量','sum'),
+        销售额=('销售总额','sum')
+    )
+    out.insert(0, '订单数', unique_orders(_df, ['订单日期'], out.index))
+    return out
+
+@st.cache_data(show_spinner=False)
+def hourly_by_day(_df, data_key):
+    return _df.groupby(['订单日期','小时'])['数量'].sum().unstack(fill_value=0).reindex(columns=range(24), fill_value=0)
+
+@st.cache_data(show_spinner=False)
+def daily_sku_agg(_df, data_key):
+    out = _df.groupby(['订单日期','SKU'], observed=True).agg(
+        销量=('数量','sum'),
+        销售额=('销售总额','sum')
+    )
+    out.insert(1, '订单量', unique_orders(_df, ['订单日期','SKU'], out.index))
+    return out
+
+@st.cache_data(show_spinner=False)
+def sku_summary(_df_full, data_key, s_date, e_date):
+    window = daily_sku_agg(_df_full, data_key).loc[pd.Timestamp(s_date):pd.Timestamp(e_date)]
+    return window.groupby(level='SKU', observed=True).sum().reset_index()
+
+def sku_table(sku_df, sort_col='销量', top_n=TOP_N_OPTIONS[0]):
+    # 占比保持数值列（显示格式由 PCT_CONFIG 负责）；只取前 top_n 个 SKU 发往前端，合计行按全部 SKU 汇总、单独返回
+    qty_total, ord_total, rev_total = sku_df['销量'].sum(), sku_df['订单量'].sum(), sku_df['销售额'].sum()
+    sku_df = sku_df.nlargest(top_n, sort_col)
+    sku_df['销量占比'] = (sku_df['销量'] / qty_total * 100).astype('float32')
+    sku_df['销售额占比'] = (sku_df['销售额'] / rev_total * 100).astype('float32')
+    total_row = pd.DataFrame([{
+        'SKU':'合计',
+        '销量':qty_total,
+        '订单量':ord_total,
+        '销售额':rev_total,
+        '销量占比':100.0,
+        '销售额占比':100.0
+    }])
+    return sku_df, total_row
+
+# 导出同样按 (data_key, 起止日期) 缓存，筛选后的表以 _df 传入不参与哈希
+@st.cache_data(show_spinner=False, max_entries=4)
+def to_csv_bytes(_df, data_key, s_date, e_date):
+    # 优先用 pyarrow 的 C++ 写出器，BOM 手动补上保证 Excel 打开中文不乱码；缺少依赖或类型不支持时回退 pandas
+    try:
+        import pyarrow as pa, pyarrow.csv as pacsv
+        table = pa.Table.from_pandas(_df, preserve_index=False)
+        # 时间列按秒写出，与 pandas 输出一致（否则带 9 位纳秒）
+        table = table.cast(pa.schema([pa.field(f.name, pa.timestamp('s')) if pa.types.is_timestamp(f.type) else f for f in table.schema]), safe=False)
+        buf = BytesIO(); buf.write(b'\xef\xbb\xbf')
+        pacsv.write_csv(table, buf)
+        return buf.getvalue()
+    except (ImportError, ValueError, TypeError, NotImplementedError):
+        return _df.to_csv(index=False).encode('utf-8-sig')
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def to_excel(_df, data_key, s_date, e_date):
     output = BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='数据', index=False)
+        _df.to_excel(writer, sheet_name='数据', index=False)
     return output.getvalue()
 
 # --------------------------
-# 侧边栏
+# 图表构建（按聚合结果缓存）
 # --------------------------
-with st.sidebar:
-    st.markdown("<h2 style='text-align:center'>📊 数据分析工具</h2>", unsafe_allow_html=True)
-    st.divider()
-
-    st.markdown("#### 📤 数据导入")
-    uploaded_file = st.file_uploader("上传Excel/CSV", type=['xlsx','csv'], label_visibility="collapsed")
-    col1, col2 = st.columns([3,1])
-    with col1:
-        if st.button("📥 导入数据", use_container_width=True):
-            if uploaded_file:
-                try:
-                    df = pd.read_csv(uploaded_file) if uploaded_file.name.endswith('.csv') else pd.read_excel(uploaded_file)
-                    st.session_state.df = df
-                    st.session_state.data_loaded = True
-                    time_candidates = [c for c in df.columns if any(x in c for x in ['时间','日期','time','date'])]
-                    st.session_state.time_column = time_candidates[0] if time_candidates else df.columns[0]
-                    st.session_state.processed_df = process_order_data(df, st.session_state.time_column)
-                    st.success("✅ 导入成功")
-                except Exception as e:
-                    st.error(f"失败：{e}")
-    with col2:
-        if st.button("🗑️ 清空", use_container_width=True):
-            st.session_state.data_loaded = False
-            st.session_state.df = None
-            st.session_state.processed_df = None
-            st.rerun()
-
-    st.divider()
-    st.markdown("#### 📋 功能选择")
-    c1,c2 = st.columns(2)
-    with c1:
-        if st.button("销量分析看板", use_container_width=True):
-            st.session_state.selected_page = "销量分析看板"
-    with c2:
-        if st.button("订单分析看板", use_container_width=True):
-            st.session_state.selected_page = "订单分析看板"
+def line_figure(x, y, x_title, y_title, rev):
+    # WebGL 折线；uirevision 取日期范围，同一范围内重跑保留用户的缩放/平移，换范围时复位
+    import plotly.graph_objects as go  # 延迟导入：未导入数据时不加载 plotly
+    fig = go.Figure(go.Scattergl(x=x, y=y, mode='lines+markers', line=dict(color='#007AFF'), marker=dict(color='#007AFF')))
+    fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)',
+                      xaxis_title=x_title, yaxis_title=y_title, uirevision=rev)
+    return fig
+
+@st.cache_data(show_spinner=False)
+def make_day_trend(day_trend, rev):
+    fig = line_figure(day_trend['订单日期'], day_trend['数量'], '订单日期', '数量', rev)
+    fig.update_layout(height=300)
+    return fig
+
+@st.cache_data(show_spinner=False)
+def make_hour_sales(hour_df, rev):
+    fig = line_figure(hour_df['小时'], hour_df['数量'], '小时', '数量', rev)
+    fig.update_layout(height=300)
+    return fig
+
+@st.cache_data(show_spinner=False)
+def make_week_bar(wdf, rev):
+    import plotly.graph_objects as go
+    fig = go.Figure(go.Bar(x=wdf['星期'], y=wdf['订单数'], marker=dict(color='#007AFF')))
+    fig.update_layout(plot_bgcolor='rgba(0,0,0,0)',paper_bgcolor='rgba(0,0,0,0)',
+                      xaxis_title='星期', yaxis_title='订单数', uirevision=rev)
+    return fig
+
+@st.cache_data(show_spinner=False)
+def make_hour_orders(hdf, rev):
+    return line_figure(hdf['小时'], hdf['订单数'], '小时', '订单数', rev)
 
 # --------------------------
-# 主界面
+# 看板片段（组件交互只重跑本片段）
 # --------------------------
-st.markdown("<h1 style='text-align:center'>跨境电商数据分析平台</h1>", unsafe_allow_html=True)
+def request_excel(xls_range):
+    # 点击回调在本轮重跑前执行，按钮自身触发的重跑即可直接渲染 Excel 下载
+    st.session_state.excel_range = xls_range
 
-if not st.session_state.data_loaded:
-    st.markdown("""
-    <div class='ios-card' style='text-align:center;padding:40px'>
-        <h3>👋 请从左侧导入订单数据</h3>
-        <p style='color:#8E8E93'>支持 Excel / CSV</p>
-    </div>""", unsafe_allow_html=True)
-else:
-    df_full = st.session_state.processed_df
-    min_date = df_full['订单日期'].min()
-    max_date = df_full['订单日期'].max()
-
-    # ==========================
-    # 销量分析看板（运营终极版）
-    # ==========================
-    if st.session_state.selected_page == "销量分析看板":
-        st.markdown("<div class='ios-card'>", unsafe_allow_html=True)
+@st.fragment
+def sku_section(df_full, data_key, df, s_date, e_date):
+    with ios_card('sku'):
+        st.markdown("### 🏆 SKU 销售分析")
+        sort_col1, sort_col2, exp_col, xls_col = st.columns([2,2,1,1])
+        with sort_col1: st.button("按销量排序", use_container_width=True)
+        with sort_col2: btn_rev = st.button("按销售额排序", use_container_width=True)
+        with exp_col:
+            st.download_button("📥 导出分析列", data=to_csv_bytes(df, data_key, s_date, e_date), file_name=f"筛选数据_分析列_{s_date}_{e_date}.csv", mime="text/csv", help=EXPORT_HELP, use_container_width=True)
+        with xls_col:
+            # Excel 写入比 CSV 慢一个量级，点击后才为当前范围生成
+            xls_range = f"{s_date}_{e_date}"
+            if st.session_state.excel_range == xls_range:
+                st.download_button("📥 Excel", data=to_excel(df, data_key, s_date, e_date), file_name=f"筛选数据_分析列_{xls_range}.xlsx", mime="application/vnd.ms-excel", help=EXPORT_HELP, use_container_width=True)
+            else:
+                st.button("生成Excel", help=EXPORT_HELP, use_container_width=True, on_click=request_excel, args=(xls_range,))
+
+        sku_all = sku_summary(df_full, data_key, s_date, e_date)
+        top_n = st.selectbox("显示 SKU 数", TOP_N_OPTIONS, key='sku_top_n')
+        sku_df, total_row = sku_table(sku_all, '销售额' if btn_rev else '销量', top_n)
+        st.dataframe(sku_df, use_container_width=True, height=380, hide_index=True, column_config=PCT_CONFIG)
+        st.dataframe(total_row, use_container_width=True, hide_index=True, column_config=PCT_CONFIG)
+        if len(sku_all) > top_n: st.caption(f"共 {len(sku_all)} 个 SKU，仅显示前 {top_n} 个；合计为全部 SKU")
+
+# ==========================
+# 销量分析看板（运营终极版）
+# ==========================
+@st.fragment
+def sales_panel(df_full, data_key, min_date, max_date):
+    with ios_card('sales-filter'):
         st.markdown("### 📈 销量分析看板")
 
         # 时间筛选
-        bc1,bc2,bc3,bc4,bc5 = st.columns(5)
-        with bc1: btn_today = st.button("今日", use_container_width=True)
-        with bc2: btn_yesterday = st.button("昨日", use_container_width=True)
-        with bc3: btn_7d = st.button("近7天", use_container_width=True)
-        with bc4: btn_14d = st.button("近14天", use_container_width=True)
-        with bc5: btn_30d = st.button("近30天", use_container_width=True)
-
-        c_start, c_end = st.columns(2)
-        with c_start: s_date = st.date_input("开始", max_date, min_value=min_date, max_value=max_date)
-        with c_end: e_date = st.date_input("结束", max_date, min_value=min_date, max_value=max_date)
-
-        if btn_today: s_date, e_date = max_date, max_date
-        elif btn_yesterday: s_date = e_date = max_date - timedelta(1)
-        elif btn_7d: s_date = max_date - timedelta(6)
-        elif btn_14d: s_date = max_date - timedelta(13)
-        elif btn_30d: s_date = max_date - timedelta(29)
+        range_choice = st.radio("快捷范围", SALES_RANGES, horizontal=True, key='sales_range', label_visibility="collapsed")
+        if range_choice == '自定义':
+            c_start, c_end = st.columns(2)
+            with c_start: s_date = st.date_input("开始", max_date, min_value=min_date, max_value=max_date)
+            with c_end: e_date = st.date_input("结束", max_date, min_value=min_date, max_value=max_date)
+        else:
+            s_date, e_date = quick_range(range_choice, min_date, max_date)
 
         s_date = validate_date(s_date)
         e_date = validate_date(e_date)
-        df = df_full[(df_full['订单日期'] >= s_date) & (df_full['订单日期'] <= e_date)].copy()
+        df = date_slice(df_full, s_date, e_date)
         days = (e_date - s_date).days + 1
+        day_slice = daily_agg(df_full, data_key).loc[pd.Timestamp(s_date):pd.Timestamp(e_date)]
 
         st.markdown(f"✅ `{s_date}` ~ `{e_date}`｜共 {len(df)} 条｜{days} 天")
-        st.markdown("</div>", unsafe_allow_html=True)
 
-        # --------------
-        # 1. 运营总览
-        # --------------
-        st.markdown("<div class='ios-card'>", unsafe_allow_html=True)
+    # --------------
+    # 1. 运营总览
+    # --------------
+    with ios_card('overview'):
         st.markdown("### 📊 运营总览")
-        total_orders = df['订单号'].nunique()
-        total_qty = df['数量'].sum()
-        total_revenue = df['销售总额'].sum()
-        avg_price = total_revenue / total_qty if total_qty else 0
-        avg_orders = total_orders / days
+        total_orders = day_slice['订单数'].sum()
+        total_qty = day_slice['数量'].sum()
+        total_revenue = day_slice['销售额'].sum()
         avg_qty = total_qty / days
 
         c1,c2,c3,c4 = st.columns(4)
@@ -187,15 +450,14 @@ else:
         with c2: st.markdown(f"<div class='metric-card'><p>总销量</p><h2>{total_qty}</h2></div>", unsafe_allow_html=True)
         with c3: st.markdown(f"<div class='metric-card'><p>总销售额</p><h2>${total_revenue:.2f}</h2></div>", unsafe_allow_html=True)
         with c4: st.markdown(f"<div class='metric-card'><p>日均销量</p><h2>{avg_qty:.1f}</h2></div>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
 
-        # --------------
-        # 2. 异常预警（新增）
-        # --------------
-        st.markdown("<div class='ios-card'>", unsafe_allow_html=True)
+    # --------------
+    # 2. 异常预警（新增）
+    # --------------
+    with ios_card('alert'):
         st.markdown("### ⚠️ 异常订单预警")
         if days >= 3:
-            day_sum = df.groupby('订单日期')['数量'].sum().sort_index()
+            day_sum = day_slice['数量']
             if len(day_sum) >= 3:
                 recent = day_sum.iloc[-1]
                 prev = day_sum.iloc[-2]
@@ -208,128 +470,139 @@ else:
                     st.success("✅ 销量平稳，无异常波动")
         else:
             st.info("ℹ️ 数据天数不足，无法预警")
-        st.markdown("</div>", unsafe_allow_html=True)
 
-        # --------------
-        # 3. 日销量趋势（新增）
-        # --------------
-        st.markdown("<div class='ios-card'>", unsafe_allow_html=True)
+    # --------------
+    # 3. 日销量趋势（新增）
+    # --------------
+    with ios_card('day-trend'):
         st.markdown("### 📅 日销量趋势")
-        day_trend = df.groupby('订单日期')['数量'].sum().reset_index()
-        fig = px.line(day_trend, x='订单日期', y='数量', markers=True, color_discrete_sequence=['#007AFF'])
-        fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', height=300)
-        st.plotly_chart(fig, use_container_width=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-        # --------------
-        # 4. 小时趋势
-        # --------------
-        st.markdown("<div class='ios-card'>", unsafe_allow_html=True)
+        day_trend = day_slice['数量'].reset_index()
+        st.plotly_chart(make_day_trend(day_trend, f"{s_date}_{e_date}"), use_container_width=True, key='day_trend')
+
+    # --------------
+    # 4. 小时趋势
+    # --------------
+    with ios_card('hour-sales'):
         st.markdown("### ⏰ 小时销量峰值")
-        hour_df = df.groupby('小时')['数量'].sum().reindex(range(24), fill_value=0).reset_index()
-        fig = px.line(hour_df, x='小时', y='数量', markers=True, color_discrete_sequence=['#007AFF'])
-        fig.update_traces(texttemplate='%{y}', textposition='top center')
-        fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', height=300)
-        st.plotly_chart(fig, use_container_width=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-        # --------------
-        # 5. SKU 分析 + 导出（新增）
-        # --------------
-        st.markdown("<div class='ios-card'>", unsafe_allow_html=True)
-        st.markdown("### 🏆 SKU 销售分析")
-        sort_col1, sort_col2, exp_col = st.columns([2,2,1])
-        with sort_col1: btn_qty = st.button("按销量排序", use_container_width=True)
-        with sort_col2: btn_rev = st.button("按销售额排序", use_container_width=True)
-        with exp_col:
-            excel_data = to_excel(df)
-            st.download_button("📥 导出", data=excel_data, file_name=f"筛选数据_{s_date}_{e_date}.xlsx", mime="application/vnd.ms-excel", use_container_width=True)
-
-        sku_df = df.groupby('SKU').agg(
-            销量=('数量','sum'),
-            订单量=('订单号','nunique'),
-            销售额=('销售总额','sum')
-        ).reset_index()
-
-        sku_df['销量占比'] = (sku_df['销量'] / sku_df['销量'].sum() * 100).round(1).astype(str) + '%'
-        sku_df['销售额占比'] = (sku_df['销售额'] / sku_df['销售额'].sum() * 100).round(1).astype(str) + '%'
-
-        if btn_qty: sku_df = sku_df.sort_values('销量', ascending=False)
-        elif btn_rev: sku_df = sku_df.sort_values('销售额', ascending=False)
-        else: sku_df = sku_df.sort_values('销量', ascending=False)
-
-        total_row = pd.DataFrame([{
-            'SKU':'合计',
-            '销量':sku_df['销量'].sum(),
-            '订单量':sku_df['订单量'].sum(),
-            '销售额':sku_df['销售额'].sum(),
-            '销量占比':'100%',
-            '销售额占比':'100%'
-        }])
-        sku_df = pd.concat([sku_df, total_row], ignore_index=True)
-        st.dataframe(sku_df, use_container_width=True, height=420)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    # ==========================
-    # 订单分析看板
-    # ==========================
-    elif st.session_state.selected_page == "订单分析看板":
-        st.markdown("<div class='ios-card'>", unsafe_allow_html=True)
+        hour_df = hourly_by_day(df_full, data_key).loc[pd.Timestamp(s_date):pd.Timestamp(e_date)].sum().rename_axis('小时').reset_index(name='数量')
+        st.plotly_chart(make_hour_sales(hour_df, f"{s_date}_{e_date}"), use_container_width=True, key='hour_sales')
+
+    # --------------
+    # 5. SKU 分析 + 导出（新增）
+    # --------------
+    sku_section(df_full, data_key, df, s_date, e_date)
+
+# ==========================
+# 订单分析看板
+# ==========================
+@st.fragment
+def order_panel(df_full, data_key, min_date, max_date):
+    with ios_card('order-filter'):
         st.markdown("### 📋 订单分析看板")
-        bc1,bc2,bc3,bc4,bc5 = st.columns(5)
-        with bc1: btn_7d = st.button("近7天", use_container_width=True)
-        with bc2: btn_14d = st.button("近14天", use_container_width=True)
-        with bc3: btn_30d = st.button("近30天", use_container_width=True)
-        with bc4: btn_last = st.button("上个月", use_container_width=True)
-        with bc5: btn_all = st.button("全部", use_container_width=True)
-
-        c_start,c_end = st.columns(2)
-        with c_start: s_date = st.date_input("开始", min_date, min_value=min_date, max_value=max_date)
-        with c_end: e_date = st.date_input("结束", max_date, min_value=min_date, max_value=max_date)
-
-        if btn_7d: s_date = max_date - timedelta(6)
-        if btn_14d: s_date = max_date - timedelta(13)
-        if btn_30d: s_date = max_date - timedelta(29)
-        if btn_all: s_date,e_date = min_date,max_date
+        range_choice = st.radio("快捷范围", ORDER_RANGES, index=ORDER_RANGES.index('全部'), horizontal=True, key='order_range', label_visibility="collapsed")
+        if range_choice == '自定义':
+            c_start,c_end = st.columns(2)
+            with c_start: s_date = st.date_input("开始", min_date, min_value=min_date, max_value=max_date)
+            with c_end: e_date = st.date_input("结束", max_date, min_value=min_date, max_value=max_date)
+        else:
+            s_date, e_date = quick_range(range_choice, min_date, max_date)
 
         s_date = validate_date(s_date)
         e_date = validate_date(e_date)
-        df = df_full[(df_full['订单日期'] >= s_date) & (df_full['订单日期'] <= e_date)]
+        df = date_slice(df_full, s_date, e_date)
         st.success(f"✅ {s_date} ~ {e_date}｜共 {len(df)} 条")
-        st.markdown("</div>", unsafe_allow_html=True)
 
-        st.markdown("<div class='ios-card'>", unsafe_allow_html=True)
+    with ios_card('order-dist'):
+        mat = week_hour_matrix(df)
         cw, ch = st.columns(2)
         with cw:
-            wdf = df.groupby('星期').size().reindex(WEEK_ORDER, fill_value=0).reset_index(name='订单数')
-            fig = px.bar(wdf,x='星期',y='订单数',color_discrete_sequence=['#007AFF'])
-            fig.update_layout(plot_bgcolor='rgba(0,0,0,0)',paper_bgcolor='rgba(0,0,0,0)')
-            st.plotly_chart(fig,use_container_width=True)
+            wdf = pd.DataFrame({'星期': WEEK_ORDER, '订单数': mat.sum(axis=1).astype(np.int32)})
+            st.plotly_chart(make_week_bar(wdf, f"{s_date}_{e_date}"),use_container_width=True,key='week_bar')
         with ch:
-            hdf = df.groupby('小时').size().reindex(range(24), fill_value=0).reset_index(name='订单数')
-            fig = px.line(hdf,x='小时',y='订单数',markers=True,color_discrete_sequence=['#007AFF'])
-            fig.update_layout(plot_bgcolor='rgba(0,0,0,0)',paper_bgcolor='rgba(0,0,0,0)')
-            st.plotly_chart(fig,use_container_width=True)
-        st.markdown("</div>", unsafe_allow_html=True)
+            hdf = pd.DataFrame({'小时': range(24), '订单数': mat.sum(axis=0).astype(np.int32)})
+            st.plotly_chart(make_hour_orders(hdf, f"{s_date}_{e_date}"),use_container_width=True,key='hour_orders')
 
-        st.markdown("<div class='ios-card'>", unsafe_allow_html=True)
+    with ios_card('rank'):
         st.markdown("### 🏆 SKU 排行榜")
-        rank = df.groupby('SKU').agg(
-            销量=('数量','sum'),
-            订单量=('订单号','nunique'),
-            销售额=('销售总额','sum')
-        ).reset_index()
-        rank['销量占比'] = (rank['销量']/rank['销量'].sum()*100).round(1).astype(str)+'%'
-        rank['销售额占比'] = (rank['销售额']/rank['销售额'].sum()*100).round(1).astype(str)+'%'
-        rank = rank.sort_values('销量', ascending=False)
-        tr = pd.DataFrame([{'SKU':'合计',
-                             '销量':rank['销量'].sum(),
-                             '订单量':rank['订单量'].sum(),
-                             '销售额':rank['销售额'].sum(),
-                             '销量占比':'100%',
-                             '销售额占比':'100%'}])
-        rank = pd.concat([rank, tr], ignore_index=True)
-        st.dataframe(rank, use_container_width=True, height=400)
-        st.markdown("</div>", unsafe_allow_html=True)
+        rank_all = sku_summary(df_full, data_key, s_date, e_date)
+        top_n = st.selectbox("显示 SKU 数", TOP_N_OPTIONS, key='rank_top_n')
+        rank, total_row = sku_table(rank_all, top_n=top_n)
+        st.dataframe(rank, use_container_width=True, height=360, hide_index=True, column_config=PCT_CONFIG)
+        st.dataframe(total_row, use_container_width=True, hide_index=True, column_config=PCT_CONFIG)
+        if len(rank_all) > top_n: st.caption(f"共 {len(rank_all)} 个 SKU，仅显示前 {top_n} 个；合计为全部 SKU")
+
+# --------------------------
+# 侧边栏
+# --------------------------
+with st.sidebar:
+    st.markdown("<h2 style='text-align:center'>📊 数据分析工具</h2>", unsafe_allow_html=True)
+    st.divider()
+
+    st.markdown("#### 📤 数据导入")
+    uploaded_file = st.file_uploader("上传Excel/CSV", type=['xlsx','csv'], label_visibility="collapsed")
+    big_mode = st.checkbox("大文件模式", help="CSV 分块解析并显示进度；原始文本列不会整表驻留内存，处理后的数据仍需全部载入")
+    col1, col2 = st.columns([3,1])
+    with col1:
+        if st.button("📥 导入数据", use_container_width=True):
+            if uploaded_file:
+                try:
+                    file_bytes = uploaded_file.getvalue()
+                    file_hash = hashlib.md5(file_bytes).hexdigest()
+                    # 同一文件重复导入时直接复用会话中已处理的数据
+                    if st.session_state.file_hash != file_hash:
+                        time_col = detect_time_column(read_head(file_bytes, uploaded_file.name).columns)
+                        if big_mode and uploaded_file.name.endswith('.csv'):
+                            progress = st.progress(0.0, text="分块解析中")
+                            processed = build_processed(file_hash, uploaded_file.name, time_col, file_bytes, progress)
+                            progress.empty()
+                        else:
+                            processed = build_processed(file_hash, uploaded_file.name, time_col, file_bytes)
+                        st.session_state.data_loaded = True
+                        st.session_state.time_column = time_col
+                        st.session_state.processed_df = processed
+                        st.session_state.file_hash = file_hash
+                        st.session_state.excel_range = None
+                    st.success("✅ 导入成功")
+                except Exception as e:
+                    st.error(f"失败：{e}")
+    with col2:
+        if st.button("🗑️ 清空", use_container_width=True):
+            if st.session_state.file_hash: remove_sidecar(st.session_state.file_hash)
+            st.session_state.data_loaded = False
+            st.session_state.processed_df = None
+            st.session_state.file_hash = None
+            st.session_state.excel_range = None
+            st.rerun()
+
+    st.divider()
+    st.markdown("#### 📋 功能选择")
+    c1,c2 = st.columns(2)
+    with c1:
+        if st.button("销量分析看板", use_container_width=True):
+            st.session_state.selected_page = "销量分析看板"
+    with c2:
+        if st.button("订单分析看板", use_container_width=True):
+            st.session_state.selected_page = "订单分析看板"
+
+# --------------------------
+# 主界面
+# --------------------------
+st.markdown("<h1 style='text-align:center'>跨境电商数据分析平台</h1>", unsafe_allow_html=True)
+
+if not st.session_state.data_loaded:
+    st.markdown("""
+    <div class='ios-card' style='text-align:center;padding:40px'>
+        <h3>👋 请从左侧导入订单数据</h3>
+        <p style='color:#8E8E93'>支持 Excel / CSV</p>
+    </div>""", unsafe_allow_html=True)
+else:
+    df_full = st.session_state.processed_df
+    # 已按订单日期排序，首尾即最小/最大日期
+    min_date = df_full['订单日期'].iloc[0].date()
+    max_date = df_full['订单日期'].iloc[-1].date()
+
+    data_key = st.session_state.file_hash
+    if st.session_state.selected_page == "销量分析看板": sales_panel(df_full, data_key, min_date, max_date)
+    elif st.session_state.selected_page == "订单分析看板": order_panel(df_full, data_key, min_date, max_date)
 
 st.markdown("<div style='text-align:center;color:#8E8E93;margin-top:30px;font-size:13px'>© 2026 跨境数据分析工具｜iOS 运营终极版</div>", unsafe_allow_html=True)